@@ -7,15 +7,16 @@ It then compiles the project and iteratively removes each include statement to c
 The script reports any redundant includes along with their file paths and line numbers in a table.
 
 Usage:
-python includeSweeper.py --path [project_path] --cmd [compile_command]
+python includeSweeper.py --path [project_path] --cmd [compile_command] [--jobs N]
 
 Example:
 python includeSweeper.py --path "path/to/project" --cmd "make all"
 python includeSweeper.py --path "path/to/project" --cmd "gcc src/main.c"
 
 Dependencies:
-- Python 3.x
+- Python 3.8+
 - tabulate package (install using 'pip install tabulate')
+- numpy package (optional, speeds up line lookups in large files)
 
 Author: Eray Ozturk | erayozturk1@gmail.com 
 URL: github.com/diffstorm
@@ -25,11 +26,41 @@ Date: 15/05/2024
 
 import os
 import re
+import json
+import shlex
+import hashlib
+import uuid
 import subprocess
 import argparse
 import shutil
+import tempfile
+import time
+import asyncio
+import bisect
+import functools
 from tabulate import tabulate
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SOURCE_EXTENSIONS = ('.c', '.cpp', '.cc', '.cxx')
+HEADER_EXTENSIONS = ('.h', '.hpp', '.hh', '.hxx')
+COMPILER_PATTERN = re.compile(r'^(.*-)?(gcc|g\+\+|cc|c\+\+|clang|clang\+\+)(-[\d.]+)?(\.exe)?$')
+SHELL_METACHARS = re.compile(r'[|&;<>$`*?\[\]~(){}#\n]')
+IDENTIFIER_PATTERN = re.compile(r'\b[A-Za-z_]\w*')
+HEADER_SYMBOL_PATTERN = re.compile(r'\b([A-Z_][A-Z0-9_]{2,}\b|[a-z_]\w*(?=\s*\())')
+C_KEYWORDS = frozenset(('if', 'for', 'while', 'switch', 'return', 'sizeof', 'defined', 'do', 'else', 'case', 'void', 'int', 'char', 'long', 'short', 'unsigned', 'signed', 'float', 'double', 'const', 'struct', 'union', 'enum', 'typedef', 'static', 'extern', 'inline'))
+INCLUDE_PATTERN = re.compile(r'^[ \t]*#[ \t]*include[ \t]*[<"]([^>"\n]+)[">]', re.MULTILINE)
+NEWLINE_PATTERN = re.compile(rb'\n')
+# String and character literals are matched too, so that comment markers inside them are left alone
+COMMENT_PATTERN = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.DOTALL)
+NON_NEWLINE_PATTERN = re.compile(r'[^\n]')
+OUTPUT_CHUNK_SIZE = 64 * 1024
+CANARY_LINE = b'\n#error includeSweeper: checking that this file is compiled\n'
+TOOLCHAIN_PROGRAMS = ('make', 'cc', 'c++', 'gcc', 'g++', 'clang', 'clang++')
+
 def parse_arguments():
     """
     Parse command-line arguments.
@@ -40,10 +71,12 @@ def parse_arguments():
     parser = argparse.ArgumentParser(description="Find redundant includes.")
     parser.add_argument("--path", required=True, help="Path to the project.")
     parser.add_argument("--cmd", required=True, help="Command to compile the project.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of parallel compile probes (default: number of CPUs).")
     args = parser.parse_args()
 
     # Normalize the path for the current operating system
     args.path = os.path.abspath(args.path)
+    args.jobs = max(1, args.jobs)
 
     return args
 
@@ -58,142 +91,902 @@ def get_files(path, extensions):
     Returns:
     - files (list of str): List of file paths.
     """
+    extensions = tuple(extensions)
     files = []
-    for root, _, filenames in os.walk(path):
-        for filename in filenames:
-            if any(filename.endswith(ext) for ext in extensions):
-                files.append(os.path.join(root, filename))
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(extensions):
+                    files.append(entry.path)
     return files
 
-def compile_project(cmd, work_dir):
+@functools.lru_cache(maxsize=None)
+def split_command(cmd):
     """
-    Compile the project and capture the output.
+    Split a command into arguments so that it can run without a shell.
+
+    Args:
+    - cmd (str): Command to compile the project.
+
+    Returns:
+    - argv (tuple of str or None): Arguments of the command, or None if it uses shell features
+      (pipes, redirections, variables, globs, environment assignments, ...), cannot be split, or the platform has no POSIX shell syntax.
+    """
+    if os.name != 'posix' or SHELL_METACHARS.search(cmd):
+        return None
+    try:
+        argv = tuple(shlex.split(cmd))
+    except ValueError:
+        # Unbalanced quotes, leave it to the shell to report
+        return None
+    if not argv or '=' in argv[0]:
+        return None
+    return argv
+
+async def compile_project(cmd, work_dir, output=None):
+    """
+    Compile the project, counting the errors and warnings chunk by chunk as its output is read.
 
     Args:
     - cmd (str): Command to compile the project.
     - work_dir (str): Working directory for the compilation.
+    - output (list or None): List to append the output chunks to (stdout and stderr combined), if they are needed.
 
     Returns:
     - returncode (int): Return code of the compilation process.
-    - stdout (str): Standard output of the compilation process.
-    - stderr (str): Standard error of the compilation process.
+    - counts (tuple of int): Number of errors and number of warnings.
     """
-    result = subprocess.run(cmd, shell=True, cwd=work_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    return result.returncode, result.stdout.decode(), result.stderr.decode()
+    argv = split_command(cmd)
+    if argv is None:
+        proc = await asyncio.create_subprocess_shell(cmd, cwd=work_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    else:
+        try:
+            proc = await asyncio.create_subprocess_exec(*argv, cwd=work_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except OSError as e:
+            # Report a missing program the way a shell would
+            message = f"{argv[0]}: error: {e.strerror}\n".encode()
+            if output is not None:
+                output.append(message)
+            return 127, count_errors_and_warnings(message)
+
+    counts = (0, 0)
+    pending = b''
+    while True:
+        chunk = await proc.stdout.read(OUTPUT_CHUNK_SIZE)
+        if not chunk:
+            break
+        if output is not None:
+            output.append(chunk)
 
-def count_errors_and_warnings(output):
+        # Only scan complete lines so that no marker is split across chunks
+        pending += chunk
+        end = pending.rfind(b'\n') + 1
+        counts = count_errors_and_warnings(pending[:end], counts)
+        pending = pending[end:]
+    return await proc.wait(), count_errors_and_warnings(pending, counts)
+
+def count_errors_and_warnings(output, counts=(0, 0)):
     """
     Count the number of errors and warnings in the compilation output.
 
     Args:
-    - output (str): Compilation output (stdout and stderr combined).
+    - output (bytes): Compilation output (stdout and stderr combined).
+    - counts (tuple of int): Number of errors and number of warnings found so far, to add to.
 
     Returns:
-    - error_count (int): Number of errors.
-    - error_lines (list of str): Lines containing errors or warnings.
+    - counts (tuple of int): Number of errors and number of warnings.
     """
-    error_lines = [line for line in output.split('\n') if "error:" in line or "warning:" in line]
-    return len(error_lines), error_lines
+    return counts[0] + output.count(b"error:"), counts[1] + output.count(b"warning:")
 
-def find_include_line(include, lines, include_pattern):
+def write_file(file, data):
     """
-    Find the line number of an include statement in the code.
+    Overwrite a file in place with a single unbuffered write, leaving it newer than every file written before.
 
     Args:
-    - include (str): Include statement to find.
-    - lines (list of str): Lines of code.
-    - include_pattern (str): Regular expression pattern for matching include statements.
+    - file (str): Path to the file.
+    - data (bytes): New contents of the file.
+    """
+    written_ns = time.time_ns()
+    fd = os.open(file, os.O_WRONLY | os.O_TRUNC | getattr(os, 'O_BINARY', 0))
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+    # File timestamps come from a coarse clock, so a build output written just before may carry the
+    # same timestamp and an incremental build would then skip the file
+    stat = os.stat(file)
+    if stat.st_mtime_ns <= written_ns:
+        os.utime(file, ns=(stat.st_atime_ns, written_ns + 1))
+
+class CompilerServer:
+    """
+    Runs the compile commands of one project copy.
+
+    Commands that need a shell are sent to one persistent shell, each followed by a sentinel line
+    carrying its exit status, so probing does not start a new shell per build. Other commands, and
+    all commands where no POSIX shell is available, run directly through compile_project.
+    """
+
+    def __init__(self, work_dir, project_path):
+        """
+        Set up the server, the shell is started when the first command needs it.
+
+        Args:
+        - work_dir (str): Working directory for the compilations, a copy of the project.
+        - project_path (str): Path to the original project.
+        """
+        self.work_dir = work_dir
+        self.project_path = project_path
+        # Only match the whole project path, so that e.g. "/x/proj2" is left alone for "/x/proj"
+        self.project_path_pattern = re.compile(re.escape(project_path) + r'(?=[/\\\s\'":;,|&<>()]|$)')
+        self.sentinel = ('__includeSweeper_done_' + uuid.uuid4().hex).encode()
+        self.proc = None
+
+    async def close(self):
+        """
+        Stop the shell.
+        """
+        if self.proc is not None:
+            self.proc.stdin.close()
+            await self.proc.wait()
+
+    def localize(self, cmd):
+        """
+        Point a command that refers to the original project at the project copy.
+
+        Args:
+        - cmd (str): Command to compile the project.
+
+        Returns:
+        - cmd (str): Command with absolute project paths replaced by the project copy.
+        """
+        return self.project_path_pattern.sub(lambda match: self.work_dir, cmd)
+
+    async def compile(self, cmd):
+        """
+        Compile the project and count the errors and warnings in its output.
+
+        Args:
+        - cmd (str): Command to compile the project.
+
+        Returns:
+        - returncode (int): Return code of the compilation process.
+        - counts (tuple of int): Number of errors and number of warnings.
+        """
+        cmd = self.localize(cmd)
+        if split_command(cmd) is not None or os.name != 'posix' or not shutil.which('bash'):
+            return await compile_project(cmd, self.work_dir)
+
+        if self.proc is None:
+            self.proc = await asyncio.create_subprocess_exec('bash', cwd=self.work_dir, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+        # Run the command in a subshell so that it cannot change the state of the server
+        self.proc.stdin.write(b'(' + cmd.encode() + b'\n) < /dev/null 2>&1\nprintf "\\n%s:%d\\n" ' + self.sentinel + b' $?\n')
+        await self.proc.stdin.drain()
+        return await self.read_output()
+
+    async def read_output(self):
+        """
+        Read the output of the current command up to the sentinel line, counting errors and warnings
+        chunk by chunk instead of keeping the whole output.
+
+        Returns:
+        - returncode (int): Return code of the compilation process.
+        - counts (tuple of int): Number of errors and number of warnings.
+        """
+        counts = (0, 0)
+        pending = b''
+        while True:
+            chunk = await self.proc.stdout.read(OUTPUT_CHUNK_SIZE)
+            if not chunk:
+                raise RuntimeError("The compiler shell exited unexpectedly.")
+
+            # Only scan complete lines so that no marker is split across chunks
+            pending += chunk
+            end = pending.rfind(b'\n') + 1
+            complete, pending = pending[:end], pending[end:]
+
+            sentinel = complete.find(self.sentinel)
+            if sentinel != -1:
+                returncode = int(complete[sentinel + len(self.sentinel) + 1:].split(b'\n', 1)[0])
+                return returncode, count_errors_and_warnings(complete[:sentinel], counts)
+            counts = count_errors_and_warnings(complete, counts)
+
+def get_line_starts(data):
+    """
+    Find the offset at which each line of a file starts.
+
+    Args:
+    - data (bytes): Contents of the file.
 
     Returns:
-    - include_line_index (int or None): Line number of the include statement, or None if not found.
+    - line_starts (list or array of int): Offset of the first byte of each line.
     """
-    include_line_index = None
-    for index, line in enumerate(lines):
-        if re.match(include_pattern.format(re.escape(include)), line):
-            include_line_index = index
-            break
-    return include_line_index
+    if np is not None:
+        return np.concatenate(([0], np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10) + 1))
+    return [0] + [match.end() for match in NEWLINE_PATTERN.finditer(data)]
 
-def remove_line_and_compile(file, cmd, work_dir, line_index):
+def get_line_indices(line_starts, offsets):
     """
-    Remove a line from a file, compile the project, and check for errors.
+    Map offsets in a file to the indices of the lines containing them.
 
     Args:
-    - file (str): Path to the file.
+    - line_starts (list or array of int): Offsets of the lines, as returned by get_line_starts.
+    - offsets (list of int): Offsets in the file, in any order.
+
+    Returns:
+    - line_indices (list of int): Index of the line containing each offset.
+    """
+    if np is not None:
+        return (np.searchsorted(line_starts, offsets, side='right') - 1).tolist()
+    return [bisect.bisect_right(line_starts, offset) - 1 for offset in offsets]
+
+def remove_lines(source, line_indices):
+    """
+    Cut lines out of the contents of a file.
+
+    Args:
+    - source (tuple): (data, line_starts) with the contents of the file and the offsets of its lines.
+    - line_indices (list of int): Indices of the lines to remove.
+
+    Returns:
+    - data (bytes): Contents without the lines.
+    """
+    data, line_starts = source
+    view = memoryview(data)
+    parts = []
+    start = 0
+    for index in sorted(line_indices):
+        parts.append(view[start:line_starts[index]])
+        start = line_starts[index + 1] if index + 1 < len(line_starts) else len(data)
+    parts.append(view[start:])
+    return b''.join(parts)
+
+async def write_and_compile(file, cmd, compiler, source, data):
+    """
+    Replace the contents of a file, compile the project, and restore the file.
+
+    Args:
+    - file (str): Path of the file relative to the project root.
+    - cmd (str): Command to compile the project.
+    - compiler (CompilerServer): Shell of the project copy to modify and build.
+    - source (tuple): (data, line_starts) with the original contents of the file and the offsets of its lines.
+    - data (bytes): Contents to compile the file with.
+
+    Returns:
+    - returncode (int): Return code of the compilation process.
+    - counts (tuple of int): Number of errors and number of warnings in the compilation output.
+    """
+    file = os.path.join(compiler.work_dir, file)
+
+    # Rewriting the file also bumps its timestamp, so an incremental build recompiles only what depends on it
+    write_file(file, data)
+    returncode, counts = await compiler.compile(cmd)
+    write_file(file, source[0])
+
+    return returncode, counts
+
+async def remove_lines_and_compile(file, cmd, compiler, source, line_indices):
+    """
+    Remove lines from a file, compile the project, and check for errors.
+
+    Args:
+    - file (str): Path of the file relative to the project root.
     - cmd (str): Command to compile the project.
+    - compiler (CompilerServer): Shell of the project copy to modify and build.
+    - source (tuple): (data, line_starts) with the original contents of the file and the offsets of its lines.
+    - line_indices (list of int): Indices of the lines to remove, may be empty to rebuild the unmodified file.
+
+    Returns:
+    - returncode (int): Return code of the compilation process.
+    - counts (tuple of int): Number of errors and number of warnings in the compilation output.
+    """
+    return await write_and_compile(file, cmd, compiler, source, remove_lines(source, line_indices))
+
+def relative_path(file, work_dir):
+    """
+    Express a path from a command line or compiler output relative to the working directory.
+
+    Args:
+    - file (str): Absolute path, or path relative to work_dir.
+    - work_dir (str): Working directory of the command.
+
+    Returns:
+    - file (str): Normalized path relative to work_dir.
+    """
+    if os.path.isabs(file):
+        file = os.path.relpath(file, start=work_dir)
+    return os.path.normpath(file)
+
+def find_dependents(argv, sources, work_dir):
+    """
+    Map each file read by the compilation to the translation units that include it, using the compiler's -M output.
+
+    Args:
+    - argv (list of str): Compiler command line without the source files.
+    - sources (list of str): Source files compiled by the command, relative to work_dir.
     - work_dir (str): Working directory for the compilation.
-    - line_index (int): Index of the line to remove.
-
-    Returns:
-    - error_count (int): Number of errors in the compilation output.
-    - error_lines (list of str): Lines containing errors or warnings in the compilation output.
-    - line_number (int): Line number of the removed line (1-based).
-    """
-    # Create a backup of the current file
-    temp_file = file + '.bak'
-    shutil.copyfile(file, temp_file)
-
-    with open(file, 'r') as f:
-        lines = f.readlines()
-
-    original_line = lines[line_index]
-    del lines[line_index]
-    with open(file, 'w') as f:
-        f.writelines(lines)
-    
-    returncode, stdout, stderr = compile_project(cmd, work_dir)
-    error_count, error_lines = count_errors_and_warnings(stdout + stderr)
-    
-    # Restore the file from the backup
-    shutil.copyfile(temp_file, file)
-    # Remove the backup file
-    os.remove(temp_file)
-    
-    return error_count, error_lines, line_index + 1  # Return line number (1-based)
 
-def remove_comments(code):
+    Returns:
+    - dependents (dict or None): File path relative to work_dir mapped to the list of source files including it,
+      or None if the dependencies could not be listed for every source file.
     """
-    Remove C/C++ comments from the code while preserving line numbers by replacing comment parts with empty spaces.
+    try:
+        result = subprocess.run(argv + ['-M'] + sources, cwd=work_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+
+    dependents = {}
+    listed_sources = set()
+    rules = result.stdout.decode(errors='replace').replace('\\\n', ' ')
+    for rule in rules.split('\n'):
+        if ':' not in rule:
+            continue
+        prerequisites = rule.split(':', 1)[1].split()
+        if not prerequisites:
+            continue
+        source = relative_path(prerequisites[0], work_dir)
+        listed_sources.add(source)
+        for header in prerequisites[1:]:
+            dependents.setdefault(relative_path(header, work_dir), []).append(source)
+
+    # Without a rule for every source some dependencies are unknown
+    if not listed_sources.issuperset(sources):
+        return None
+    return dependents
+
+def index_files_by_name(files):
+    """
+    Index the project files by every name an include statement could refer to them by.
+
+    Args:
+    - files (list of str): Paths of the project files.
+
+    Returns:
+    - files_by_name (dict): Trailing path components (e.g. "utils.h", "include/utils.h") mapped to the set of matching files.
+    """
+    files_by_name = {}
+    for file in files:
+        parts = file.split(os.sep)
+        for index in range(len(parts)):
+            files_by_name.setdefault('/'.join(parts[index:]), set()).add(file)
+    return files_by_name
+
+@functools.lru_cache(maxsize=None)
+def normalize_include(include):
+    """
+    Reduce an include name to the path components used by index_files_by_name.
 
     Args:
-    - code (list of str): List of lines of code.
+    - include (str): Include name as written in the include statement.
 
     Returns:
-    - code_without_comments (list of str): List of lines with comments removed.
+    - name (str): Include name without separators, "." and ".." components.
     """
-    code_without_comments = []
-    in_block_comment = False
+    return '/'.join(part for part in include.replace('\\', '/').split('/') if part not in ('', '.', '..'))
+
+def build_include_graph(includes_by_file, files_by_name):
+    """
+    Build the include graph of the project from its include statements.
+
+    Include names are matched against the trailing components of the project file paths,
+    so a name may resolve to several headers and the graph errs on the side of extra edges.
+
+    Args:
+    - includes_by_file (dict): File path mapped to the list of include names found in it.
+    - files_by_name (dict): Project files indexed by index_files_by_name.
 
-    for line in code:
-        if in_block_comment:
-            clean_line = ''
+    Returns:
+    - deps (dict): File path mapped to the set of project headers it includes.
+    """
+    deps = {}
+    for file, includes in includes_by_file.items():
+        deps[file] = set()
+        for include in includes:
+            deps[file].update(files_by_name.get(normalize_include(include), ()))
+    return deps
+
+def get_reachable_files(deps, units):
+    """
+    Find the files that are compiled, i.e. the translation units and every header they include directly or indirectly.
+
+    Args:
+    - deps (dict): File path mapped to the set of project headers it includes.
+    - units (list of str): Translation units to start from.
+
+    Returns:
+    - reachable (set of str): Paths of the files reachable from the translation units.
+    """
+    reachable = set()
+    stack = list(units)
+    while stack:
+        file = stack.pop()
+        if file not in reachable:
+            reachable.add(file)
+            stack.extend(deps[file])
+    return reachable
+
+def get_system_include_dirs():
+    """
+    Ask the system C compiler for its include search path.
+
+    Returns:
+    - include_dirs (tuple of str): Directories searched for <...> includes.
+    """
+    try:
+        result = subprocess.run(['cc', '-E', '-v', '-x', 'c', os.devnull], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError:
+        return ('/usr/local/include', '/usr/include')
+
+    include_dirs = []
+    in_search_list = False
+    for line in result.stderr.decode(errors='replace').splitlines():
+        if line.startswith('#include <...> search starts here:'):
+            in_search_list = True
+        elif line.startswith('End of search list.'):
+            break
+        elif in_search_list:
+            include_dirs.append(line.strip())
+    return tuple(include_dirs) or ('/usr/local/include', '/usr/include')
+
+def resolve_header(include, files_by_name, system_include_dirs):
+    """
+    Find the header an include statement refers to, looking at the project files first.
+
+    Args:
+    - include (str): Include name as written in the include statement.
+    - files_by_name (dict): Project files indexed by index_files_by_name.
+    - system_include_dirs (tuple of str): Directories searched for system headers.
+
+    Returns:
+    - header (str or None): Path of the header, or None if it was not found.
+    """
+    name = normalize_include(include)
+    if name in files_by_name:
+        return min(files_by_name[name])
+    return find_system_header(name, system_include_dirs)
+
+@functools.lru_cache(maxsize=None)
+def find_system_header(name, system_include_dirs):
+    """
+    Look up a header in the system include directories, once per include name.
+
+    Args:
+    - name (str): Normalized include name.
+    - system_include_dirs (tuple of str): Directories searched for system headers.
+
+    Returns:
+    - header (str or None): Path of the header, or None if it was not found.
+    """
+    for include_dir in system_include_dirs:
+        header = os.path.join(include_dir, name)
+        if os.path.isfile(header):
+            return header
+    return None
+
+@functools.lru_cache(maxsize=None)
+def get_header_symbols(header):
+    """
+    Extract the names a header likely declares: upper case macros and constants, and functions.
+
+    Args:
+    - header (str): Path to the header.
+
+    Returns:
+    - symbols (frozenset of str): Declared names, without reserved (underscore) names and keywords.
+    """
+    try:
+        with open(header, 'r', errors='replace') as f:
+            code = f.read()
+    except OSError:
+        return frozenset()
+    code = remove_comments(code)
+    symbols = {match.group(1) for match in HEADER_SYMBOL_PATTERN.finditer(code)}
+    return frozenset(symbol for symbol in symbols if not symbol.startswith('_') and symbol not in C_KEYWORDS)
+
+def estimate_build_costs(deps, sizes):
+    """
+    Estimate how much has to be recompiled when a file changes, as the total size of the translation units including it.
+
+    Args:
+    - deps (dict): File path mapped to the set of project headers it includes.
+    - sizes (dict): File path mapped to its size in bytes.
+
+    Returns:
+    - build_costs (dict): File path mapped to the estimated cost of rebuilding after changing it.
+    """
+    build_costs = dict.fromkeys(deps, 0)
+    for unit in deps:
+        if unit.endswith(SOURCE_EXTENSIONS):
+            for file in get_reachable_files(deps, [unit]):
+                build_costs[file] += sizes[unit]
+    return build_costs
+
+def get_file_commands(cmd, files, work_dir):
+    """
+    Work out the command to rebuild after modifying each file.
+
+    A direct compiler invocation (e.g. "gcc src/main.c src/utils.c") is narrowed to compiling only
+    the translation units affected by the file, discarding the object files. They are really compiled
+    rather than only checked with -fsyntax-only, which would miss the warnings of later stages
+    such as -Wunused-function. Any other command (e.g. "make")
+    is kept as is and left to do its own incremental rebuild.
+
+    Args:
+    - cmd (str): Command to compile the project.
+    - files (list of str): Paths of the files relative to work_dir.
+    - work_dir (str): Working directory for the compilation.
+
+    Returns:
+    - file_cmds (dict): File mapped to the command to run, or None if the compiler's dependency
+      output shows that the file is not part of the build.
+    """
+    argv = split_command(cmd)
+    if argv is None or not COMPILER_PATTERN.match(os.path.basename(argv[0])):
+        return {file: cmd for file in files}
+
+    flags = []
+    sources = []
+    skip_next = False
+    for arg in argv:
+        if skip_next:
+            skip_next = False
+        elif arg == '-o':
+            skip_next = True
+        elif arg in ('-c', '-S', '-E') or (arg.startswith('-o') and len(arg) > 2):
+            continue
+        elif not arg.startswith('-') and arg.endswith(SOURCE_EXTENSIONS):
+            sources.append(relative_path(arg, work_dir))
         else:
-            clean_line = ''
-
-        i = 0
-        while i < len(line):
-            if not in_block_comment:
-                if line[i:i+2] == '/*':
-                    in_block_comment = True
-                    clean_line += ' ' * (len(line) - i)  # Replace the rest of the line with spaces
-                    i += 1
-                elif line[i:i+2] == '//':
-                    clean_line += ' ' * (len(line) - i)  # Replace the rest of the line with spaces
-                    break
+            flags.append(arg)
+
+    dependents = find_dependents(flags, sources, work_dir)
+    if dependents is None:
+        return {file: cmd for file in files}
+
+    # -o cannot be combined with -c for several sources, so each one is compiled separately
+    unit_cmds = {source: shlex.join(flags + ['-c', '-o', os.devnull, source]) for source in sources}
+
+    file_cmds = {}
+    for file in files:
+        affected = [file] if file in sources else dependents.get(file, [])
+        file_cmds[file] = ' && '.join(unit_cmds[source] for source in affected) if affected else None
+    return file_cmds
+
+def hash_tree(path, cmd):
+    """
+    Compute a hash of the state of the project and the toolchain from the paths, modification times and sizes of their files.
+
+    Every file of the project counts, not only the sources, so that changes to build files,
+    build outputs or generated files are noticed too.
+
+    Args:
+    - path (str): Path to the project.
+    - cmd (str): Command to compile the project, its program is checked along with the usual build tools.
+
+    Returns:
+    - tree_hash (str): Hex digest identifying the current state of the project and the toolchain.
+    """
+    skipped = {os.path.join(path, '.git'), os.path.dirname(os.path.abspath(get_cache_file()))}
+    states = []
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.path in skipped:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
                 else:
-                    clean_line += line[i]
-            else:
-                if line[i:i+2] == '*/':
-                    in_block_comment = False
-                    i += 1
-            i += 1
-
-        if not in_block_comment and '//' not in line:
-            code_without_comments.append(clean_line)
-        else:
-            code_without_comments.append(clean_line.rstrip())
+                    stat = entry.stat(follow_symlinks=False)
+                    states.append(f"{os.path.relpath(entry.path, start=path)}|{stat.st_mtime_ns}|{stat.st_size}")
+
+    argv = split_command(cmd)
+    for program in TOOLCHAIN_PROGRAMS + (argv[:1] if argv else ()):
+        program_path = shutil.which(program)
+        if program_path is not None:
+            stat = os.stat(program_path)
+            states.append(f"{program}|{program_path}|{stat.st_mtime_ns}|{stat.st_size}")
+
+    tree_hash = hashlib.blake2b()
+    for state in sorted(states):
+        tree_hash.update(state.encode() + b'\n')
+    return tree_hash.hexdigest()
+
+def cache_key(*parts):
+    """
+    Build a cache key from the inputs that determine a compilation result.
+
+    Args:
+    - parts: Values identifying the compilation (command, ...).
 
-    return code_without_comments
+    Returns:
+    - key (str): Hex digest of the parts.
+    """
+    return hashlib.blake2b('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+def get_cache_file():
+    """
+    Get the path of the file holding the results of previous runs.
+
+    Returns:
+    - cache_file (str): Path in the user's cache directory.
+    """
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_dir, 'includesweeper', 'baselines.json')
+
+def load_cache():
+    """
+    Load the results of previous runs.
+
+    Returns:
+    - cache (dict): Project path mapped to tree hash, mapped to command hash, mapped to the results.
+    """
+    try:
+        with open(get_cache_file(), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def get_cache_entry(cache, path, tree_hash, cmd):
+    """
+    Get the results for the current state of a project and a command, dropping those of its older states.
+
+    Args:
+    - cache (dict): Results loaded by load_cache.
+    - path (str): Path to the project.
+    - tree_hash (str): Hash of the current state of the project files.
+    - cmd (str): Command to compile the project.
+
+    Returns:
+    - entry (dict): Cached "base_counts" of the initial build if known, and "redundant_lines" mapping files to the indices of their redundant include lines.
+    """
+    # Results of other states can never be hit again once a file has changed
+    cache[path] = {tree_hash: cache.get(path, {}).get(tree_hash, {})}
+    return cache[path][tree_hash].setdefault(cache_key(cmd), {"redundant_lines": {}})
+
+def save_cache(cache):
+    """
+    Save the results of this run for later runs.
+
+    Args:
+    - cache (dict): Results loaded by load_cache and updated by this run.
+    """
+    cache_file = get_cache_file()
+    temp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+
+        # Replace the file at once so that concurrent runs never read a partial file
+        with open(temp_file, 'w') as f:
+            json.dump(cache, f)
+        os.replace(temp_file, cache_file)
+    except OSError as e:
+        # The results are still reported, they are only not reused by later runs
+        print(f"Could not save the results to '{cache_file}': {e.strerror}")
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+def create_work_dirs(path, count):
+    """
+    Create shadow copies of the project so that probes can run in parallel without interfering.
+
+    Args:
+    - path (str): Path to the project.
+    - count (int): Number of copies to create.
+
+    Returns:
+    - root (str): Temporary directory holding all copies.
+    - work_dirs (list of str): Paths to the project copies.
+    """
+    root = tempfile.mkdtemp(prefix='includeSweeper-')
+    work_dirs = []
+    for index in range(count):
+        work_dir = os.path.join(root, str(index))
+        shutil.copytree(path, work_dir, symlinks=True, ignore=shutil.ignore_patterns('.git'))
+        work_dirs.append(work_dir)
+    return root, work_dirs
+
+def is_clean_probe(returncode, counts, base_counts, batch):
+    """
+    Decide whether removing lines left the build as clean as the baseline.
+
+    Errors and warnings are compared separately, so that a new error cannot hide behind a warning
+    that went away. A batch must match the baseline exactly: if one of its removals made a warning
+    go away, another one could have added a warning in its place, so the batch has to be split.
+
+    Args:
+    - returncode (int): Return code of the probe build.
+    - counts (tuple of int): Number of errors and number of warnings of the probe build.
+    - base_counts (tuple of int): Number of errors and number of warnings when rebuilding the unmodified file.
+    - batch (bool): Whether several lines were removed at once.
+
+    Returns:
+    - clean (bool): True if the removed lines are redundant.
+    """
+    if returncode != 0:
+        return False
+    if batch:
+        return tuple(counts) == tuple(base_counts)
+    return counts[0] <= base_counts[0] and counts[1] <= base_counts[1]
+
+async def find_redundant_lines(compiler, file, cmd, source, line_indices, base_counts):
+    """
+    Bisect a list of includes: remove them all at once and only split the batch further if that changes the build output.
+
+    Args:
+    - compiler (CompilerServer): Shell of the project copy to probe in.
+    - file (str): Path of the file relative to the project root.
+    - cmd (str): Command to run after modifying the file.
+    - source (tuple): (data, line_starts) with the original contents of the file and the offsets of its lines.
+    - line_indices (list of int): Indices of the include lines to check.
+    - base_counts (tuple of int): Number of errors and number of warnings when rebuilding the unmodified file.
+
+    Returns:
+    - redundant_lines (list of int): Indices of the include lines that can be removed.
+    """
+    returncode, counts = await remove_lines_and_compile(file, cmd, compiler, source, line_indices)
+    if is_clean_probe(returncode, counts, base_counts, len(line_indices) > 1):
+        return list(line_indices)
+    if len(line_indices) == 1:
+        return []
+
+    middle = len(line_indices) // 2
+    return await find_redundant_lines(compiler, file, cmd, source, line_indices[:middle], base_counts) + await find_redundant_lines(compiler, file, cmd, source, line_indices[middle:], base_counts)
+
+async def sweep_file(compiler, file, cmd, project_cmd, source, includes, likely_used, needed_includes):
+    """
+    Find the redundant includes of a file in a project copy.
+
+    Includes that are likely used would only make a batch fail, so they are checked one by one
+    and only the others are bisected. Includes found to be needed in other files count as likely used.
+
+    Args:
+    - compiler (CompilerServer): Shell of the project copy to probe in.
+    - file (str): Path of the file relative to the project root.
+    - cmd (str): Command to run after modifying the file.
+    - project_cmd (str): Command to compile the project.
+    - source (tuple): (data, line_starts) with the original contents of the file and the offsets of its lines.
+    - includes (list of tuple): (include, line_index) for each include statement to check.
+    - likely_used (set of int): Indices of the include lines whose header declares a name used by the file.
+    - needed_includes (set of str): Normalized names of the includes found to be needed so far, updated with this file's.
+
+    Returns:
+    - redundant_lines (list of int or None): Indices of the include lines that can be removed,
+      or None if the build does not compile this copy of the file.
+    """
+    line_indices = [line_index for _, line_index in includes]
+    likely_used = likely_used | {line_index for include, line_index in includes if normalize_include(include) in needed_includes}
+
+    # A narrowed compiler command keeps no build outputs and only compiles files that depend on this one
+    if cmd == project_cmd:
+        # Restoring the files swept before in this copy made them newer than their build outputs,
+        # rebuild them first so that their output does not count towards this file's baseline
+        await compiler.compile(cmd)
+
+        # A file that cannot break the build is not compiled, or the build reads it from outside the copy,
+        # either way removing its lines proves nothing
+        returncode, counts = await write_and_compile(file, cmd, compiler, source, source[0] + CANARY_LINE)
+        if returncode == 0 and counts[0] == 0:
+            return None
+
+    # Incremental builds only report on the rebuilt files, so compare against a rebuild of the unmodified file
+    _, base_counts = await remove_lines_and_compile(file, cmd, compiler, source, [])
+    redundant_lines = []
+    unlikely_used = [index for index in line_indices if index not in likely_used]
+    if unlikely_used:
+        redundant_lines += await find_redundant_lines(compiler, file, cmd, source, unlikely_used, base_counts)
+    for index in line_indices:
+        if index in likely_used:
+            returncode, counts = await remove_lines_and_compile(file, cmd, compiler, source, [index])
+            if is_clean_probe(returncode, counts, base_counts, False):
+                redundant_lines.append(index)
+
+    for include, line_index in includes:
+        if line_index not in redundant_lines:
+            needed_includes.add(normalize_include(include))
+    return redundant_lines
+
+async def sweep_file_in_free_copy(free_compilers, file, cmd, project_cmd, source, includes, likely_used, needed_includes):
+    """
+    Wait for a project copy to become free, then find the redundant includes of a file in it.
+
+    Args:
+    - free_compilers (asyncio.Queue): CompilerServers of the project copies not in use.
+    - file (str): Path of the file relative to the project root.
+    - cmd (str or None): Command to run after modifying the file, None if the file is not part of the build.
+    - project_cmd (str): Command to compile the project.
+    - source (tuple): (data, line_starts) with the original contents of the file and the offsets of its lines.
+    - includes (list of tuple): (include, line_index) for each include statement to check.
+    - likely_used (set of int): Indices of the include lines whose header declares a name used by the file.
+    - needed_includes (set of str): Normalized names of the includes found to be needed so far.
+
+    Returns:
+    - redundant_lines (list of int or None): Indices of the include lines that can be removed,
+      or None if the build does not compile this copy of the file.
+    """
+    if cmd is None:
+        return [line_index for _, line_index in includes]
+
+    compiler = await free_compilers.get()
+    try:
+        return await sweep_file(compiler, file, cmd, project_cmd, source, includes, likely_used, needed_includes)
+    finally:
+        free_compilers.put_nowait(compiler)
+
+async def sweep_files(path, cmd, file_cmds, sweeps, jobs):
+    """
+    Find the redundant includes of several files, running up to `jobs` builds concurrently.
+
+    Each concurrent build gets its own copy of the project and its own CompilerServer.
+    Files are swept in the given order, so cheap files listed first provide early evidence
+    of which includes are needed.
+
+    Args:
+    - path (str): Path to the project.
+    - cmd (str): Command to compile the project.
+    - file_cmds (dict): File mapped to the command to run after modifying it, or None if the file is not part of the build.
+    - sweeps (list of tuple): (file, source, includes, likely_used) for each file to check.
+    - jobs (int): Maximum number of concurrent builds.
+
+    Returns:
+    - redundant_lines (dict or None): File mapped to the indices of its include lines that can be removed,
+      or to None if the build does not compile the file in the copy. None if the copies do not build.
+    """
+    work_root, work_dirs = create_work_dirs(path, jobs)
+    compilers = [CompilerServer(work_dir, path) for work_dir in work_dirs]
+    try:
+        free_compilers = asyncio.Queue()
+        for compiler in compilers:
+            free_compilers.put_nowait(compiler)
+
+        # Warm up every copy so that probes only rebuild what they modify
+        warm_ups = await asyncio.gather(*(compiler.compile(cmd) for compiler in compilers))
+        if any(returncode != 0 for returncode, _ in warm_ups):
+            return None
+
+        needed_includes = set()
+        results = await asyncio.gather(*(sweep_file_in_free_copy(free_compilers, file, file_cmds[file], cmd, source, includes, likely_used, needed_includes) for file, source, includes, likely_used in sweeps))
+        return {sweep[0]: redundant_lines for sweep, redundant_lines in zip(sweeps, results)}
+    finally:
+        for compiler in compilers:
+            await compiler.close()
+        shutil.rmtree(work_root, ignore_errors=True)
+
+def blank_comment(match):
+    """
+    Replace a comment with spaces, keeping its line breaks, and leave string literals unchanged.
+
+    Args:
+    - match (re.Match): Comment or string literal matched by COMMENT_PATTERN.
+
+    Returns:
+    - text (str): Replacement text of the same length.
+    """
+    text = match.group(0)
+    if text[0] in '"\'':
+        return text
+    return NON_NEWLINE_PATTERN.sub(' ', text)
+
+def remove_comments(code):
+    """
+    Remove C/C++ comments from the code while preserving line numbers by replacing comment parts with empty spaces.
+
+    Args:
+    - code (str): Source code.
+
+    Returns:
+    - code_without_comments (str): Source code with comments removed.
+    """
+    return COMMENT_PATTERN.sub(blank_comment, code)
 
 def main():
     args = parse_arguments()
@@ -210,47 +1003,105 @@ def main():
     os.chdir(path)
 
     try:
-        # Check if the project compiles successfully before modifications
-        print("Checking initial compilation...")
-        base_returncode, base_stdout, base_stderr = compile_project(cmd, os.getcwd())
-        if base_returncode != 0:
-            print("Error: The project does not compile successfully without modifications.")
-            print(base_stdout)
-            print(base_stderr)
-            return
-
-        base_error_count, base_error_lines = count_errors_and_warnings(base_stdout + base_stderr)
-        
-        extensions = ['.c', '.cpp', '.h', '.hpp']
-        files = get_files(path, extensions)
+        files = get_files(path, SOURCE_EXTENSIONS + HEADER_EXTENSIONS)
 
-        redundant_includes = {}
+        cache = load_cache()
+        results = get_cache_entry(cache, path, hash_tree(path, cmd), cmd)
+
+        if "base_counts" in results:
+            print("Reusing the results of a previous run...")
+        else:
+            # Check if the project compiles successfully before modifications
+            print("Checking initial compilation...")
+            base_output = []
+            base_returncode, base_counts = asyncio.run(compile_project(cmd, os.getcwd(), base_output))
+            if base_returncode != 0:
+                print("Error: The project does not compile successfully without modifications.")
+                print(b''.join(base_output).decode(errors='replace'))
+                return
 
-        include_pattern = r'#\s*include\s*[<"]{}[">]'
+            # The build may have written its outputs into the project, key the results by the state it left
+            results = get_cache_entry(cache, path, hash_tree(path, cmd), cmd)
+            results["base_counts"] = base_counts
+
+        redundant_includes = {}
 
         print("Processing files...")
+        files_by_name = index_files_by_name([os.path.relpath(file, start=path) for file in files])
+        system_include_dirs = get_system_include_dirs()
+
+        work_items = []
+        includes_by_file = {}
+        likely_used_by_file = {}
+        sources = {}
         for file in files:
-            with open(file, 'r') as f:
-                lines = remove_comments(f.readlines())
+            with open(file, 'rb') as f:
+                data = f.read()
+            line_starts = get_line_starts(data)
+            sources[os.path.relpath(file, start=path)] = (data, line_starts)
+
+            # Latin-1 maps every byte to one character, so offsets in the code are byte offsets in the file
+            code = remove_comments(data.decode('latin-1'))
+
+            # Scan the whole file at once and map match offsets to line indices
+            matches = list(INCLUDE_PATTERN.finditer(code))
+            include_hits = list(zip([match.group(1) for match in matches], get_line_indices(line_starts, [match.start() for match in matches])))
+            includes_by_file[os.path.relpath(file, start=path)] = [include for include, _ in include_hits]
+
+            # An include whose header declares a name used in the file is probably needed
+            identifiers = set(IDENTIFIER_PATTERN.findall(code))
+            likely_used = likely_used_by_file.setdefault(os.path.relpath(file, start=path), set())
+
+            for include, include_line_index in include_hits:
+                work_items.append((os.path.relpath(file, start=path), include, include_line_index))
+
+                header = resolve_header(include, files_by_name, system_include_dirs)
+                if header is not None and not get_header_symbols(header).isdisjoint(identifiers):
+                    likely_used.add(include_line_index)
+
+        # The include graph is built from include names alone, so it only orders the probes and decides nothing
+        deps = build_include_graph(includes_by_file, files_by_name)
+        probed_includes = {}
+        for file, include, line_index in work_items:
+            probed_includes.setdefault(file, []).append((include, line_index))
+
+        # Results are cached per tree state, so unchanged projects are not rebuilt on later runs
+        missing_files = [file for file in probed_includes if file not in results["redundant_lines"]]
+
+        if missing_files:
+            file_cmds = get_file_commands(cmd, missing_files, path)
+
+            # Sweep the files that are cheapest to rebuild first
+            build_costs = estimate_build_costs(deps, {file: len(data) for file, (data, _) in sources.items()})
+            missing_files.sort(key=build_costs.get)
+
+            sweeps = [(file, sources[file], probed_includes[file], likely_used_by_file[file]) for file in missing_files]
+            jobs = min(args.jobs, len(missing_files))
+            redundant_lines_by_file = asyncio.run(sweep_files(path, cmd, file_cmds, sweeps, jobs))
+
+            # Copies that do not build, or builds that never compile the copied files, mean the build refers to the original project
+            if redundant_lines_by_file is None or all(redundant_lines is None for redundant_lines in redundant_lines_by_file.values()):
+                print("Error: The project does not build in a temporary copy of its directory.")
+                print("Make sure its build files do not refer to the project directory by an absolute or parent-relative path.")
+                return
+
+            for file, redundant_lines in redundant_lines_by_file.items():
+                if redundant_lines is None:
+                    print(f"Skipping {file}: it is not compiled by the command.")
+                results["redundant_lines"][file] = redundant_lines
 
-            includes = [re.findall(include_pattern.format(r'(.*)'), line) for line in lines]
-            includes = [item for sublist in includes for item in sublist]
+        save_cache(cache)
 
-            for include in includes:
-                include_line_index = find_include_line(include, lines, include_pattern)    
-                if include_line_index is not None:
-                    error_count, error_lines, line_number = remove_line_and_compile(file, cmd, os.getcwd(), include_line_index)
-                    if error_count <= base_error_count:
-                        if file not in redundant_includes:
-                            redundant_includes[file] = []
-                        redundant_includes[file].append((include, line_number))
+        for file, include, line_index in work_items:
+            if line_index in (results["redundant_lines"][file] or ()):
+                if file not in redundant_includes:
+                    redundant_includes[file] = []
+                redundant_includes[file].append((include, line_index + 1))
 
         table_data = []
         for file, includes in redundant_includes.items():
             for include, line_number in includes:
-                # Get the relative path from the provided --path
-                relative_path = os.path.relpath(file, start=path)
-                table_data.append([include, relative_path, line_number])
+                table_data.append([include, file, line_number])
 
         print(f"Directory: {path}")
         if table_data:
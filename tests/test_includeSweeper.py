@@ -0,0 +1,382 @@
+"""
+Tests for includeSweeper.py
+
+Run from the repository root with:
+python -m unittest discover tests
+"""
+
+import os
+import re
+import sys
+import shutil
+import asyncio
+import tempfile
+import subprocess
+import unittest
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT_DIR, 'src', 'includeSweeper.py')
+TEST_PROJECT = os.path.join(ROOT_DIR, 'test')
+
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+import includeSweeper
+
+TABLE_ROW_PATTERN = re.compile(r'^\|\s*\d+\s*\|\s*(\S+)\s*\|\s*(\S+)\s*\|\s*(\d+)\s*\|$', re.MULTILINE)
+
+class FakeCompiler:
+    """
+    Stands in for a CompilerServer: reports an error for each required line missing from the probed file
+    and a warning for each noisy line left in it.
+    """
+
+    def __init__(self, work_dir, file, required_lines, noisy_lines=(), fail_on_error=True):
+        self.work_dir = work_dir
+        self.file = file
+        self.required_lines = required_lines
+        self.noisy_lines = noisy_lines
+        self.fail_on_error = fail_on_error
+        self.builds = 0
+
+    async def compile(self, cmd):
+        self.builds += 1
+        with open(os.path.join(self.work_dir, self.file), 'rb') as f:
+            lines = f.read().split(b'\n')
+        error_count = sum(1 for line in self.required_lines if line not in lines)
+        warning_count = sum(1 for line in self.noisy_lines if line in lines)
+        return (1 if error_count and self.fail_on_error else 0), (error_count, warning_count)
+
+class TestLines(unittest.TestCase):
+
+    DATA = b'#include <a.h>\n#include <b.h>\n\nint x;\n#include <c.h>'
+
+    def test_remove_lines(self):
+        source = (self.DATA, includeSweeper.get_line_starts(self.DATA))
+        self.assertEqual(includeSweeper.remove_lines(source, [1, 3]), b'#include <a.h>\n\n#include <c.h>')
+        self.assertEqual(includeSweeper.remove_lines(source, [4, 0]), b'#include <b.h>\n\nint x;\n')
+        self.assertEqual(includeSweeper.remove_lines(source, []), self.DATA)
+
+    def test_get_line_indices(self):
+        offsets = [0, 14, 15, 30, 31, len(self.DATA) - 1]
+        expected = [0, 0, 1, 2, 3, 4]
+        line_starts = includeSweeper.get_line_starts(self.DATA)
+        self.assertEqual(includeSweeper.get_line_indices(line_starts, offsets), expected)
+
+        # Same result without NumPy
+        with mock.patch.object(includeSweeper, 'np', None):
+            line_starts = includeSweeper.get_line_starts(self.DATA)
+            self.assertEqual(list(line_starts), [0, 15, 30, 31, 38])
+            self.assertEqual(includeSweeper.get_line_indices(line_starts, offsets), expected)
+
+class TestRemoveComments(unittest.TestCase):
+
+    def test_comments_are_blanked(self):
+        code = 'int a; // one\n/* two\nthree */ int b;\n'
+        result = includeSweeper.remove_comments(code)
+        self.assertEqual(len(result), len(code))
+        self.assertEqual(result.split('\n'), ['int a;       ', '      ', '         int b;', ''])
+
+    def test_string_literals_are_kept(self):
+        code = 'char *s = "// not /* a comment"; char c = \'/\'; // comment\n'
+        self.assertEqual(includeSweeper.remove_comments(code), 'char *s = "// not /* a comment"; char c = \'/\';           \n')
+
+    def test_commented_include_is_not_found(self):
+        code = includeSweeper.remove_comments('/*\n#include <a.h>\n*/\n#include <b.h>\n')
+        self.assertEqual(includeSweeper.INCLUDE_PATTERN.findall(code), ['b.h'])
+
+@unittest.skipUnless(os.name == 'posix', "commands are only split on POSIX platforms")
+class TestSplitCommand(unittest.TestCase):
+
+    def test_plain_command(self):
+        self.assertEqual(includeSweeper.split_command('gcc -I"my include" src/main.c'), ('gcc', '-Imy include', 'src/main.c'))
+
+    def test_shell_features(self):
+        for cmd in ('make && true', 'gcc src/*.c', 'make > log', 'gcc $CFLAGS main.c', 'CC=gcc make', ''):
+            self.assertIsNone(includeSweeper.split_command(cmd), cmd)
+
+    def test_unbalanced_quotes(self):
+        self.assertIsNone(includeSweeper.split_command('make "all'))
+
+class TestLocalize(unittest.TestCase):
+
+    def test_whole_paths_only(self):
+        compiler = includeSweeper.CompilerServer('/tmp/work', '/x/proj')
+        self.assertEqual(compiler.localize('gcc -I/x/proj/include -I/x/proj2/include "/x/proj" /x/proj'),
+                         'gcc -I/tmp/work/include -I/x/proj2/include "/tmp/work" /tmp/work')
+
+class TestFindRedundantLines(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.work_dir)
+
+    def find_redundant_lines(self, lines, required_lines, noisy_lines=(), fail_on_error=True):
+        data = b'\n'.join(lines) + b'\n'
+        with open(os.path.join(self.work_dir, 'a.c'), 'wb') as f:
+            f.write(data)
+        compiler = FakeCompiler(self.work_dir, 'a.c', required_lines, noisy_lines, fail_on_error)
+        source = (data, includeSweeper.get_line_starts(data))
+        base_counts = (0, len(noisy_lines))
+        redundant_lines = asyncio.run(includeSweeper.find_redundant_lines(compiler, 'a.c', 'cc', source, list(range(len(lines))), base_counts))
+
+        # The file is always restored
+        with open(os.path.join(self.work_dir, 'a.c'), 'rb') as f:
+            self.assertEqual(f.read(), data)
+        return sorted(redundant_lines), compiler.builds
+
+    def test_mixed(self):
+        lines = [b'#include <a.h>', b'#include <b.h>', b'#include <c.h>', b'#include <d.h>']
+        self.assertEqual(self.find_redundant_lines(lines, [lines[0], lines[2]])[0], [1, 3])
+
+    def test_all_redundant_in_one_build(self):
+        lines = [b'#include <%d.h>' % index for index in range(8)]
+        self.assertEqual(self.find_redundant_lines(lines, []), (list(range(8)), 1))
+
+    def test_error_does_not_hide_behind_dropped_warning(self):
+        # Removing types.h adds an error, removing noisy.h drops a warning: the batch has as many diagnostics as the baseline
+        lines = [b'#include "types.h"', b'#include "noisy.h"']
+        for fail_on_error in (True, False):
+            self.assertEqual(self.find_redundant_lines(lines, [lines[0]], [lines[1]], fail_on_error)[0], [1])
+
+    def test_dropped_warning_splits_batch(self):
+        lines = [b'#include "noisy.h"', b'#include <a.h>', b'#include <b.h>']
+        self.assertEqual(self.find_redundant_lines(lines, [], [lines[0]]), ([0, 1, 2], 3))
+
+    def test_none_redundant(self):
+        lines = [b'#include <a.h>', b'#include <b.h>', b'#include <c.h>']
+        self.assertEqual(self.find_redundant_lines(lines, lines)[0], [])
+
+class TestHeaders(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def write(self, name, code):
+        file = os.path.join(self.temp_dir, name)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with open(file, 'w') as f:
+            f.write(code)
+        return file
+
+    def test_header_symbols(self):
+        header = self.write('symbols.h', '#define MAX_SIZE 10\n'
+                                         'int compute_total(int count);\n'
+                                         '/* old_helper(int) */\n'
+                                         'int _reserved(void);\n'
+                                         '#if defined(X) && sizeof (int)\n'
+                                         'typedef int lower_case_type;\n')
+        self.assertEqual(includeSweeper.get_header_symbols(header), {'MAX_SIZE', 'compute_total'})
+        self.assertEqual(includeSweeper.get_header_symbols(os.path.join(self.temp_dir, 'missing.h')), frozenset())
+
+    def test_resolve_project_header_first(self):
+        system_dir = os.path.dirname(self.write(os.path.join('system', 'utils.h'), ''))
+        system_header = self.write(os.path.join('system', 'sys', 'types.h'), '')
+        files_by_name = includeSweeper.index_files_by_name([os.path.join('include', 'utils.h'), os.path.join('src', 'main.c')])
+        system_dirs = (os.path.join(self.temp_dir, 'nowhere'), system_dir)
+
+        self.assertEqual(includeSweeper.resolve_header('utils.h', files_by_name, system_dirs), os.path.join('include', 'utils.h'))
+        self.assertEqual(includeSweeper.resolve_header('../include/utils.h', files_by_name, system_dirs), os.path.join('include', 'utils.h'))
+        self.assertEqual(includeSweeper.resolve_header('sys/types.h', files_by_name, system_dirs), system_header)
+        self.assertIsNone(includeSweeper.resolve_header('missing.h', files_by_name, system_dirs))
+
+@unittest.skipUnless(shutil.which('gcc'), "gcc is needed to list the dependencies")
+class TestFileCommands(unittest.TestCase):
+
+    FILES = ['src/main.c', 'src/utils.c', 'include/utils.h', 'include/unused.h']
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.project = os.path.join(self.temp_dir, 'test')
+        shutil.copytree(TEST_PROJECT, self.project)
+        open(os.path.join(self.project, 'include', 'unused.h'), 'w').close()
+
+    def unit_cmd(self, flags, unit):
+        return f"gcc {flags} -c -o {os.devnull} {unit}"
+
+    def test_relative_sources(self):
+        file_cmds = includeSweeper.get_file_commands('gcc -Wall -Iinclude src/main.c src/utils.c -o main', self.FILES, self.project)
+        self.assertEqual(file_cmds, {
+            'src/main.c': self.unit_cmd('-Wall -Iinclude', 'src/main.c'),
+            'src/utils.c': self.unit_cmd('-Wall -Iinclude', 'src/utils.c'),
+            'include/utils.h': self.unit_cmd('-Wall -Iinclude', 'src/main.c') + ' && ' + self.unit_cmd('-Wall -Iinclude', 'src/utils.c'),
+            # The compiler's dependency listing proves the header is not part of the build
+            'include/unused.h': None,
+        })
+
+    def test_absolute_sources(self):
+        include_dir = os.path.join(self.project, 'include')
+        main_file = os.path.join(self.project, 'src', 'main.c')
+        file_cmds = includeSweeper.get_file_commands(f"gcc -I{include_dir} {main_file} src/utils.c", self.FILES, self.project)
+        self.assertEqual(file_cmds['src/main.c'], self.unit_cmd(f"-I{include_dir}", 'src/main.c'))
+        self.assertEqual(file_cmds['include/utils.h'], self.unit_cmd(f"-I{include_dir}", 'src/main.c') + ' && ' + self.unit_cmd(f"-I{include_dir}", 'src/utils.c'))
+        self.assertIsNone(file_cmds['include/unused.h'])
+
+    def test_failed_dependency_listing_keeps_command(self):
+        # The include directory is missing, so the dependencies cannot be listed
+        cmd = 'gcc src/main.c src/utils.c'
+        self.assertIsNone(includeSweeper.find_dependents(['gcc'], ['src/main.c', 'src/utils.c'], self.project))
+        self.assertEqual(includeSweeper.get_file_commands(cmd, self.FILES, self.project), {file: cmd for file in self.FILES})
+
+    def test_other_commands_are_kept(self):
+        for cmd in ('make', 'gcc src/*.c'):
+            self.assertEqual(includeSweeper.get_file_commands(cmd, self.FILES, self.project), {file: cmd for file in self.FILES})
+
+class TestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.project = os.path.join(self.temp_dir, 'project')
+        os.makedirs(os.path.join(self.project, 'src'))
+        for name in ('Makefile', os.path.join('src', 'main.c')):
+            with open(os.path.join(self.project, name), 'w') as f:
+                f.write('x\n')
+
+        patcher = mock.patch.dict(os.environ, XDG_CACHE_HOME=os.path.join(self.temp_dir, 'cache'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def touch(self, name, data='x\n'):
+        file = os.path.join(self.project, name)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        mtime_ns = os.stat(file).st_mtime_ns if os.path.exists(file) else 0
+        with open(file, 'w') as f:
+            f.write(data)
+        os.utime(file, ns=(mtime_ns + 1000000000, mtime_ns + 1000000000))
+
+    def test_tree_hash_follows_every_project_file(self):
+        tree_hash = includeSweeper.hash_tree(self.project, 'make')
+        self.assertEqual(includeSweeper.hash_tree(self.project, 'make'), tree_hash)
+
+        # Build files and new files count as much as sources
+        for name in ('Makefile', os.path.join('src', 'main.c'), os.path.join('src', 'extra.cc')):
+            self.touch(name)
+            new_hash = includeSweeper.hash_tree(self.project, 'make')
+            self.assertNotEqual(new_hash, tree_hash, name)
+            tree_hash = new_hash
+
+    def test_tree_hash_ignores_git_and_cache(self):
+        tree_hash = includeSweeper.hash_tree(self.project, 'make')
+        self.touch(os.path.join('.git', 'index'))
+        self.assertEqual(includeSweeper.hash_tree(self.project, 'make'), tree_hash)
+
+        # A cache directory inside the project
+        with mock.patch.dict(os.environ, XDG_CACHE_HOME=os.path.join(self.project, '.cache')):
+            tree_hash = includeSweeper.hash_tree(self.project, 'make')
+            includeSweeper.save_cache({'project': {}})
+            self.assertEqual(includeSweeper.hash_tree(self.project, 'make'), tree_hash)
+
+    def test_cache_entry_per_state_and_command(self):
+        cache = {}
+        entry = includeSweeper.get_cache_entry(cache, self.project, 'state1', 'make')
+        entry["base_counts"] = [0, 1]
+        entry["redundant_lines"]["src/main.c"] = [2]
+        self.assertNotIn("base_counts", includeSweeper.get_cache_entry(cache, self.project, 'state1', 'make all'))
+
+        includeSweeper.save_cache(cache)
+        cache = includeSweeper.load_cache()
+        self.assertEqual(includeSweeper.get_cache_entry(cache, self.project, 'state1', 'make'), {"base_counts": [0, 1], "redundant_lines": {"src/main.c": [2]}})
+
+        # A new state of the project drops the results of the older ones
+        self.assertNotIn("base_counts", includeSweeper.get_cache_entry(cache, self.project, 'state2', 'make'))
+        self.assertEqual(list(cache[self.project]), ['state2'])
+
+    def test_unreadable_cache(self):
+        os.makedirs(os.path.dirname(includeSweeper.get_cache_file()))
+        with open(includeSweeper.get_cache_file(), 'w') as f:
+            f.write('{not json')
+        self.assertEqual(includeSweeper.load_cache(), {})
+
+class TestSweepOrder(unittest.TestCase):
+
+    def test_build_costs(self):
+        deps = {'a.c': {'common.h'}, 'b.cc': {'common.h', 'b.h'}, 'common.h': set(), 'b.h': {'common.h'}, 'orphan.h': set()}
+        sizes = {'a.c': 10, 'b.cc': 100, 'common.h': 1000, 'b.h': 1000, 'orphan.h': 1000}
+        build_costs = includeSweeper.estimate_build_costs(deps, sizes)
+        self.assertEqual(build_costs, {'a.c': 10, 'b.cc': 100, 'common.h': 110, 'b.h': 100, 'orphan.h': 0})
+        self.assertEqual(sorted(deps, key=build_costs.get), ['orphan.h', 'a.c', 'b.cc', 'b.h', 'common.h'])
+
+    def test_needed_includes_are_shared(self):
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        lines = [b'#include <a.h>', b'#include <b.h>', b'#include <c.h>']
+        data = b'\n'.join(lines) + b'\n'
+        with open(os.path.join(work_dir, 'a.c'), 'wb') as f:
+            f.write(data)
+        source = (data, includeSweeper.get_line_starts(data))
+        includes = [('a.h', 0), ('b.h', 1), ('c.h', 2)]
+
+        def sweep(needed_includes):
+            compiler = FakeCompiler(work_dir, 'a.c', [lines[0]])
+            # A narrowed command, so no catch-up build is needed
+            redundant_lines = asyncio.run(includeSweeper.sweep_file(compiler, 'a.c', 'cc -c a.c', 'cc', source, includes, set(), needed_includes))
+            return sorted(redundant_lines), compiler.builds
+
+        # Baseline, the failing batch and its two halves
+        needed_includes = set()
+        self.assertEqual(sweep(needed_includes), ([1, 2], 4))
+        self.assertEqual(needed_includes, {'a.h'})
+
+        # Knowing a.h is needed elsewhere, it is probed alone and the rest passes as one batch
+        self.assertEqual(sweep(needed_includes), ([1, 2], 3))
+
+@unittest.skipUnless(shutil.which('make') and shutil.which('gcc'), "make and gcc are needed to build the test project")
+class TestProject(unittest.TestCase):
+    """
+    Run the script on the test project and compare against the table in test/README.md.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.project = os.path.join(self.temp_dir, 'test')
+        shutil.copytree(TEST_PROJECT, self.project)
+
+        with open(os.path.join(TEST_PROJECT, 'README.md'), 'r') as f:
+            self.expected = set(TABLE_ROW_PATTERN.findall(f.read()))
+
+    def run_script(self, cmd, cache_dir=None):
+        env = dict(os.environ, XDG_CACHE_HOME=cache_dir or os.path.join(self.temp_dir, 'cache'))
+        result = subprocess.run([sys.executable, SCRIPT, '--path', self.project, '--cmd', cmd, '--jobs', '2'],
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env, universal_newlines=True)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        return result.stdout
+
+    def test_make(self):
+        output = self.run_script('make')
+        self.assertIn("Checking initial compilation...", output)
+        self.assertEqual(set(TABLE_ROW_PATTERN.findall(output)), self.expected)
+
+        # The second run reuses the cached results
+        output = self.run_script('make')
+        self.assertNotIn("Checking initial compilation...", output)
+        self.assertEqual(set(TABLE_ROW_PATTERN.findall(output)), self.expected)
+
+    def test_changed_file_invalidates_cache(self):
+        self.run_script('make')
+
+        main_file = os.path.join(self.project, 'src', 'main.c')
+        stat = os.stat(main_file)
+        os.utime(main_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+
+        output = self.run_script('make')
+        self.assertIn("Checking initial compilation...", output)
+        self.assertEqual(set(TABLE_ROW_PATTERN.findall(output)), self.expected)
+
+    def test_unwritable_cache(self):
+        # A regular file where the cache directory should be
+        cache_dir = os.path.join(self.temp_dir, 'not_a_dir')
+        open(cache_dir, 'w').close()
+
+        output = self.run_script('make', cache_dir)
+        self.assertIn("Could not save the results", output)
+        self.assertEqual(set(TABLE_ROW_PATTERN.findall(output)), self.expected)
+
+    def test_compiler_command(self):
+        output = self.run_script(f"gcc -Wall -Wextra -I{os.path.join(self.project, 'include')} src/main.c {os.path.join(self.project, 'src', 'utils.c')}")
+        self.assertEqual(set(TABLE_ROW_PATTERN.findall(output)), self.expected)
+
+if __name__ == '__main__':
+    unittest.main()